@@ -4,17 +4,29 @@ FastAPI server for Nomic Embed Vision v1.5 with OpenAI-compatible API
 Supports both text and image embeddings in a shared embedding space
 """
 
+import os
+
+# Configure the CUDA caching allocator before torch is imported; an existing setting takes precedence
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:128")
+
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 from typing import List, Union, Optional, Dict, Any
 import torch
 import torch.nn.functional as F
+from torchvision.transforms import v2
 from transformers import AutoTokenizer, AutoModel, AutoImageProcessor
 from PIL import Image
-import base64
+from cachetools import LRUCache
+import pybase64
+import hashlib
 import io
+import types
 import uvicorn
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 # Configure logging
@@ -24,41 +36,130 @@ logger = logging.getLogger(__name__)
 # Global variables for models
 vision_model = None
 text_model = None
+eager_text_model = None
 processor = None
 tokenizer = None
+query_prefix_ids = None
+device = None
+model_dtype = None
+
+# GPU image preprocessing matching the processor; None runs the processor on the CPU
+image_transform = None
+
+# Request batchers and the single thread that runs all model forwards
+text_batcher = None
+image_batcher = None
+gpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+
+# Recently computed embeddings keyed by input type and content hash, stored as fp16 to halve their memory;
+# a cache hit therefore returns fp16-rounded values where the original miss returned full fp32
+EMBEDDING_CACHE_SIZE = 100_000
+embedding_cache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE)
+
+# Base64 encoding formats and the little-endian dtype each packs; "base64" matches the OpenAI API
+BASE64_FORMATS = {
+    "base64": "<f4",
+    "base64_fp16": "<f2"
+}
+
+# Directory of an exported OpenVINO text encoder, used instead of PyTorch on CPU-only hosts
+OPENVINO_TEXT_MODEL = os.environ.get("OPENVINO_TEXT_MODEL")
+
+# Padded sequence lengths for text batches; fixed shapes let compiled graphs be reused
+SEQUENCE_BUCKETS = (32, 64, 128, 256, 512)
+
+# Micro-batch sizes for model forwards; large requests are split to bound memory
+TEXT_BATCH_SIZE = 32
+IMAGE_BATCH_SIZE = 32
+
+# Padded micro-batch sizes on CUDA so compiled graphs are reused; must reach the micro-batch sizes
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+# Sequences longer than the largest bucket run eagerly, in micro-batches limited to this many tokens
+TEXT_TOKEN_BUDGET = TEXT_BATCH_SIZE * SEQUENCE_BUCKETS[-1]
+
+# Minimum per-token cosine similarity between SDPA and eager attention outputs for SDPA to be kept
+SDPA_MIN_SIMILARITY = 0.999
+
+# Dynamic batching: inputs from concurrent requests arriving within the wait window share a forward
+MAX_BATCH_SIZE = 32
+MAX_BATCH_WAIT = 0.005
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Load models on startup and cleanup on shutdown"""
-    global vision_model, text_model, processor, tokenizer
+    global vision_model, text_model, eager_text_model, processor, tokenizer, query_prefix_ids, device, model_dtype
+    global text_batcher, image_batcher, image_transform
 
     logger.info("Loading Nomic Embed Vision v1.5 models...")
 
     try:
+        # Pick device and precision: half precision on GPU (bf16 on hardware with native support, e.g. Ampere+), fp32 on CPU
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        if device.type == "cuda":
+            model_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported(including_emulation=False) else torch.float16
+        else:
+            model_dtype = torch.float32
+
         # Load vision components
         processor = AutoImageProcessor.from_pretrained("nomic-ai/nomic-embed-vision-v1.5")
-        vision_model = AutoModel.from_pretrained(
+        vision_model = load_model(
             "nomic-ai/nomic-embed-vision-v1.5",
-            trust_remote_code=True
+            {"pixel_values": torch.randn(2, 3, processor.crop_size["height"], processor.crop_size["width"])}
         )
 
         # Load text components
         tokenizer = AutoTokenizer.from_pretrained("nomic-ai/nomic-embed-text-v1.5")
-        text_model = AutoModel.from_pretrained(
-            "nomic-ai/nomic-embed-text-v1.5",
-            trust_remote_code=True
-        )
-
-        # Set models to evaluation mode
-        vision_model.eval()
-        text_model.eval()
+        query_prefix_ids = tokenizer("search_query:", add_special_tokens=False).input_ids
+        if device.type == "cpu" and OPENVINO_TEXT_MODEL:
+            text_model = load_openvino_model(OPENVINO_TEXT_MODEL)
+        if text_model is None:
+            text_model = load_model(
+                "nomic-ai/nomic-embed-text-v1.5",
+                dict(tokenizer(
+                    ["search_query: hello", "search_document: a longer example to check padded attention"],
+                    padding=True,
+                    return_tensors="pt"
+                ))
+            )
+        eager_text_model = text_model
 
-        # Move to GPU if available
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        vision_model.to(device)
-        text_model.to(device)
+        if device.type == "cuda":
+            logger.info(
+                f"CUDA allocator: {torch.cuda.get_allocator_backend()} "
+                f"({os.environ['PYTORCH_CUDA_ALLOC_CONF']})"
+            )
 
-        logger.info(f"Models loaded successfully on device: {device}")
+        # Resize and normalize images on the GPU instead of in the CPU processor
+        if device.type == "cuda":
+            size = processor.size
+            crop_size = processor.crop_size
+            image_transform = v2.Compose([
+                v2.Resize(
+                    size["shortest_edge"] if "shortest_edge" in size else (size["height"], size["width"]),
+                    interpolation=v2.InterpolationMode.BICUBIC,
+                    antialias=True
+                ),
+                v2.CenterCrop((crop_size["height"], crop_size["width"])),
+                v2.ToDtype(torch.float32, scale=True),
+                v2.Normalize(mean=processor.image_mean, std=processor.image_std)
+            ])
+
+        # Compile the encoders and warm them up so compilation happens off the request path
+        if device.type == "cuda":
+            vision_model = torch.compile(vision_model, mode="reduce-overhead", dynamic=True)
+            text_model = torch.compile(text_model, mode="reduce-overhead", dynamic=True)
+            await asyncio.get_running_loop().run_in_executor(gpu_executor, warmup)
+
+        logger.info(f"Models loaded successfully on device: {device} ({model_dtype})")
+
+        # Start request batchers
+        text_batcher = Batcher(process_text_input)
+        image_batcher = Batcher(process_image_input)
+        batcher_tasks = [
+            asyncio.create_task(text_batcher.run()),
+            asyncio.create_task(image_batcher.run())
+        ]
 
     except Exception as e:
         logger.error(f"Failed to load models: {e}")
@@ -68,6 +169,9 @@ async def lifespan(app: FastAPI):
 
     # Cleanup
     logger.info("Shutting down...")
+    for task in batcher_tasks:
+        task.cancel()
+    gpu_executor.shutdown(wait=False)
 
 app = FastAPI(
     title="Nomic Embed Vision API",
@@ -89,13 +193,13 @@ class EmbeddingRequest(BaseModel):
         description="Input text, image, or list of inputs to embed"
     )
     model: str = Field(default="nomic-embed-vision-v1.5", description="Model to use")
-    encoding_format: str = Field(default="float", description="Encoding format")
+    encoding_format: str = Field(default="float", description="Encoding format: 'float', 'base64' (float32) or 'base64_fp16'; values served from the embedding cache have fp16 precision")
     dimensions: Optional[int] = Field(default=None, description="Number of dimensions (not supported)")
 
 class EmbeddingData(BaseModel):
     """Individual embedding result"""
     object: str = "embedding"
-    embedding: List[float]
+    embedding: Union[List[float], str]
     index: int
 
 class Usage(BaseModel):
@@ -110,13 +214,87 @@ class EmbeddingResponse(BaseModel):
     model: str
     usage: Usage
 
+def load_model(name: str, example_inputs: Dict[str, torch.Tensor]):
+    """Load a model for inference on the serving device, with SDPA attention if it matches eager on the example"""
+    model = AutoModel.from_pretrained(
+        name,
+        trust_remote_code=True,
+        torch_dtype=model_dtype
+    ).eval().to(device)
+
+    # nomic_bert is remote code without transformers' attn_implementation support, so patch its attention
+    attention_modules = [module for module in model.modules() if hasattr(module, "Wqkv") and hasattr(module, "out_proj")]
+    if not attention_modules:
+        logger.info(f"No NomicBert attention modules in {name}, keeping its attention")
+        return model
+
+    example_inputs = {key: value.to(device) for key, value in example_inputs.items()}
+    with torch.inference_mode(), autocast():
+        expected = model(**example_inputs)[0]
+        for module in attention_modules:
+            module.forward = types.MethodType(sdpa_attention_forward, module)
+
+        try:
+            actual = model(**example_inputs)[0]
+            similarity = F.cosine_similarity(actual.float(), expected.float(), dim=-1).min().item()
+        except Exception as e:
+            logger.warning(f"SDPA attention failed for {name}: {e}")
+            similarity = None
+
+    if similarity is None or similarity < SDPA_MIN_SIMILARITY:
+        # Dropping the instance attribute restores the class's eager forward
+        for module in attention_modules:
+            del module.forward
+        logger.warning(f"Keeping eager attention for {name} (SDPA similarity {similarity})")
+    else:
+        logger.info(f"Using SDPA attention for {name} (similarity to eager {similarity:.5f})")
+
+    return model
+
+def sdpa_attention_forward(self, hidden_states, attention_mask=None, *args, **kwargs):
+    """NomicBertAttention forward computing attention with F.scaled_dot_product_attention"""
+    # KV caching, unpadded (cu_seqlens) inputs and head-major rotary fall back to the original forward
+    unsupported = {key for key, value in kwargs.items() if value is not None and value is not False}
+    unsupported -= {"position_ids", "is_padded_inputs", "max_seq_len"}
+    if args or unsupported or getattr(self, "rotary_head_dim", False):
+        return type(self).forward(self, hidden_states, attention_mask, *args, **kwargs)
+
+    qkv = self.Wqkv(hidden_states).unflatten(-1, (3, self.num_heads, self.head_dim))
+    if self.rotary_emb_dim > 0:
+        qkv = self.rotary_emb(qkv, seqlen_offset=0)
+
+    # [batch, seq, 3, heads, head_dim] -> 3 x [batch, heads, seq, head_dim]
+    query, key, value = qkv.permute(2, 0, 3, 1, 4).unbind(0)
+    if attention_mask is not None:
+        attention_mask = attention_mask.to(query.dtype)
+
+    attn_output = F.scaled_dot_product_attention(query, key, value, attn_mask=attention_mask)
+    return self.out_proj(attn_output.transpose(1, 2).flatten(2))
+
+def load_openvino_model(path: str):
+    """Load an exported OpenVINO feature-extraction model, or None if optimum-intel is unavailable"""
+    try:
+        from optimum.intel import OVModelForFeatureExtraction
+    except ImportError:
+        logger.warning("optimum-intel is not installed, falling back to the PyTorch text model")
+        return None
+
+    # The exported config keeps nomic_bert's auto_map, so resolving it needs the remote code
+    logger.info(f"Loading OpenVINO text model from {path}")
+    return OVModelForFeatureExtraction.from_pretrained(path, trust_remote_code=True)
+
+def autocast():
+    """Autocast context for model forwards (no-op when running in fp32 on CPU)"""
+    return torch.autocast(
+        device_type=device.type,
+        dtype=model_dtype,
+        enabled=model_dtype != torch.float32
+    )
+
 def mean_pooling(model_output, attention_mask):
-    """Mean pooling for text embeddings"""
+    """Mean pooling for text embeddings, with attention_mask as a float [batch, seq, 1] tensor"""
     token_embeddings = model_output[0]
-    input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
-    return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(
-        input_mask_expanded.sum(1), min=1e-9
-    )
+    return (token_embeddings * attention_mask).sum(1) / attention_mask.sum(1).clamp(min=1e-9)
 
 def decode_base64_image(base64_string: str) -> Image.Image:
     """Decode base64 image string to PIL Image"""
@@ -125,57 +303,240 @@ def decode_base64_image(base64_string: str) -> Image.Image:
         if base64_string.startswith('data:'):
             base64_string = base64_string.split(',', 1)[1]
 
-        image_data = base64.b64decode(base64_string)
+        image_data = pybase64.b64decode(base64_string, validate=False)
         image = Image.open(io.BytesIO(image_data))
+
+        # Let the JPEG decoder downscale while decoding; the processor only needs ~2x its input size
+        edge = 2 * (processor.size.get("shortest_edge") or processor.size["height"])
+        image.draft('RGB', (edge, edge))
+        image.load()
+
         return image.convert('RGB')
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid base64 image: {str(e)}")
 
+def encode_embeddings(embeddings: torch.Tensor, encoding_format: str) -> List[Union[List[float], str]]:
+    """Convert embeddings to response values: float lists or packed little-endian base64"""
+    embeddings = embeddings.to("cpu", dtype=torch.float32).contiguous()
+
+    if encoding_format in BASE64_FORMATS:
+        rows = embeddings.numpy().astype(BASE64_FORMATS[encoding_format], copy=False)
+        return [pybase64.b64encode(row.tobytes()).decode('ascii') for row in rows]
+
+    return embeddings.tolist()
+
+def bucket_length(length: int) -> int:
+    """Round a sequence length up to the nearest padding bucket"""
+    for bucket in SEQUENCE_BUCKETS:
+        if length <= bucket:
+            return bucket
+
+    # Longer inputs round up to a multiple of the largest bucket
+    largest = SEQUENCE_BUCKETS[-1]
+    return min(-(-length // largest) * largest, tokenizer.model_max_length)
+
+def bucket_batch_size(size: int) -> int:
+    """Round a micro-batch size up to the nearest batch bucket when running compiled on CUDA"""
+    if device.type != "cuda":
+        return size
+    return next(bucket for bucket in BATCH_BUCKETS if size <= bucket)
+
+def warmup():
+    """Run dummy forwards for every (batch, sequence) bucket so no CUDA graph is recorded on the request path"""
+    filler = [tokenizer.unk_token_id]
+    for batch_size in BATCH_BUCKETS:
+        logger.info(f"Warming up models with batch size {batch_size}...")
+        for length in SEQUENCE_BUCKETS:
+            ids = tokenizer.build_inputs_with_special_tokens(filler * (length - tokenizer.num_special_tokens_to_add()))
+            embed_text_batch([ids] * batch_size)
+        process_image_input([Image.new("RGB", (224, 224))] * batch_size)
+
 def process_text_input(texts: List[str]) -> torch.Tensor:
     """Process text inputs and return embeddings"""
-    device = next(text_model.parameters()).device
-
-    # Add search_query prefix as recommended by Nomic
-    prefixed_texts = []
-    for text in texts:
-        if not text.startswith('search_query:') and not text.startswith('search_document:'):
-            text = f'search_query: {text}'
-        prefixed_texts.append(text)
-
-    # Tokenize
-    encoded_input = tokenizer(
-        prefixed_texts,
-        padding=True,
-        truncation=True,
+    # Tokenize without special tokens; the prefix and special tokens are added as ids below
+    encoded_texts = tokenizer(texts, add_special_tokens=False).input_ids
+    max_length = tokenizer.model_max_length - tokenizer.num_special_tokens_to_add()
+
+    # Add search_query prefix as recommended by Nomic, then truncate and wrap with special tokens
+    input_ids = []
+    for text, ids in zip(texts, encoded_texts):
+        if not text.startswith(('search_query:', 'search_document:')):
+            ids = query_prefix_ids + ids
+        input_ids.append(tokenizer.build_inputs_with_special_tokens(ids[:max_length]))
+
+    # Sort by length so each micro-batch pads to a similar length
+    lengths = [len(ids) for ids in input_ids]
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+
+    embeddings = None
+    start = 0
+    while start < len(order):
+        # Size the micro-batch by a token budget when its longest sequence is beyond the largest bucket
+        padded_length = bucket_length(lengths[order[min(start + TEXT_BATCH_SIZE, len(order)) - 1]])
+        batch_size = TEXT_BATCH_SIZE
+        if padded_length > SEQUENCE_BUCKETS[-1]:
+            batch_size = max(1, TEXT_TOKEN_BUDGET // padded_length)
+
+        batch_indices = order[start:start + batch_size]
+        batch_embeddings = embed_text_batch([input_ids[i] for i in batch_indices])
+        start += batch_size
+
+        # Write each micro-batch back to its original positions in a preallocated output
+        if embeddings is None:
+            embeddings = batch_embeddings.new_empty((len(texts), batch_embeddings.shape[1]))
+        embeddings[batch_indices] = batch_embeddings
+
+    return embeddings
+
+def embed_text_batch(batch: List[List[int]]) -> torch.Tensor:
+    """Pad a tokenized micro-batch to its batch and sequence buckets and return embeddings"""
+    padded_length = bucket_length(max(len(ids) for ids in batch))
+
+    # Compiled graphs only cover the sequence buckets; longer batches run eagerly without batch padding
+    compiled = padded_length <= SEQUENCE_BUCKETS[-1]
+
+    # Fill the batch bucket by repeating the first row; the extra rows are dropped after pooling
+    size = len(batch)
+    if compiled:
+        batch = batch + [batch[0]] * (bucket_batch_size(size) - size)
+
+    # Padding also builds the attention mask
+    encoded_input = tokenizer.pad(
+        {'input_ids': batch},
+        padding='max_length',
+        max_length=padded_length,
         return_tensors='pt'
     ).to(device)
 
     # Generate embeddings
-    with torch.no_grad():
-        model_output = text_model(**encoded_input)
-        embeddings = mean_pooling(model_output, encoded_input['attention_mask'])
-        embeddings = F.layer_norm(embeddings, normalized_shape=(embeddings.shape[1],))
+    with torch.inference_mode(), autocast():
+        model_output = (text_model if compiled else eager_text_model)(**encoded_input)
+
+    # Pool and normalize in fp32 to preserve fidelity
+    with torch.inference_mode():
+        attention_mask = encoded_input['attention_mask'].unsqueeze(-1).float()
+        embeddings = mean_pooling(model_output, attention_mask)
+        # Mean-centre instead of layer_norm: its per-row variance scaling is cancelled by normalize
+        embeddings = embeddings - embeddings.mean(dim=1, keepdim=True)
         embeddings = F.normalize(embeddings, p=2, dim=1)
 
-    return embeddings
+    return embeddings[:size]
+
+def preprocess_images(images: List[Image.Image]) -> torch.Tensor:
+    """Resize, crop and normalize images into a pixel batch on the serving device"""
+    if image_transform is None:
+        return processor(images, return_tensors="pt")["pixel_values"].to(device)
+
+    # Upload raw uint8 pixels through pinned memory and transform them on the GPU
+    return torch.stack([
+        image_transform(
+            v2.functional.pil_to_tensor(image).pin_memory().to(device, non_blocking=True)
+        )
+        for image in images
+    ])
 
 def process_image_input(images: List[Image.Image]) -> torch.Tensor:
     """Process image inputs and return embeddings"""
-    device = next(vision_model.parameters()).device
+    embeddings = None
+
+    for start in range(0, len(images), IMAGE_BATCH_SIZE):
+        # Preprocess the micro-batch and run a single batched forward
+        pixel_values = preprocess_images(images[start:start + IMAGE_BATCH_SIZE])
 
-    embeddings_list = []
+        # Fill the batch bucket by repeating the first image; the extra rows are dropped below
+        size = len(pixel_values)
+        padding = bucket_batch_size(size) - size
+        if padding:
+            pixel_values = torch.cat([pixel_values, pixel_values[:1].expand(padding, -1, -1, -1)])
 
-    for image in images:
-        # Process image
-        inputs = processor(image, return_tensors="pt").to(device)
+        # Generate embeddings
+        with torch.inference_mode(), autocast():
+            img_emb = vision_model(pixel_values=pixel_values).last_hidden_state[:size, 0]
 
-        # Generate embedding
-        with torch.no_grad():
-            img_emb = vision_model(**inputs).last_hidden_state
-            img_embedding = F.normalize(img_emb[:, 0], p=2, dim=1)
-            embeddings_list.append(img_embedding)
+        # Normalize in fp32 to preserve fidelity, straight into a preallocated output
+        if embeddings is None:
+            embeddings = torch.empty((len(images), img_emb.shape[1]), device=device, dtype=torch.float32)
+        F.normalize(img_emb.float(), p=2, dim=1, out=embeddings[start:start + len(img_emb)])
 
-    return torch.cat(embeddings_list, dim=0)
+    return embeddings
+
+class Batcher:
+    """Coalesces inputs from concurrent requests into shared model forwards"""
+
+    def __init__(self, process_fn):
+        self.process_fn = process_fn
+        self.queue = asyncio.Queue()
+
+    async def embed(self, inputs: list) -> torch.Tensor:
+        """Queue inputs for the next batch and wait for their fp32 embeddings on the CPU"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((inputs, future))
+        return await future
+
+    def forward(self, inputs: list) -> torch.Tensor:
+        """Run the model and copy the embeddings to the CPU as fp32, on the executor thread"""
+        # CUDA kernels run asynchronously; the blocking device-to-host copy must not wait on the event loop
+        return self.process_fn(inputs).to("cpu", dtype=torch.float32)
+
+    async def run(self):
+        """Collect queued requests into batches, run them and scatter the results"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            pending = [await self.queue.get()]
+            batch_size = len(pending[0][0])
+
+            # Keep collecting until the batch is full or the wait window closes
+            deadline = loop.time() + MAX_BATCH_WAIT
+            while batch_size < MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                batch_size += len(item[0])
+
+            inputs = [x for request_inputs, _ in pending for x in request_inputs]
+            try:
+                embeddings = await loop.run_in_executor(gpu_executor, self.forward, inputs)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            start = 0
+            for request_inputs, future in pending:
+                # Skip requests that were cancelled while waiting
+                if not future.done():
+                    future.set_result(embeddings[start:start + len(request_inputs)])
+                start += len(request_inputs)
+
+async def decode_images(urls: List[str]) -> List[Image.Image]:
+    """Decode base64 images concurrently off the event loop"""
+    return await asyncio.gather(*[asyncio.to_thread(decode_base64_image, url) for url in urls])
+
+async def embed_cached(batcher: Batcher, input_type: str, inputs: List[str], prepare=None) -> torch.Tensor:
+    """Embed inputs through a batcher, serving repeated inputs from the embedding cache"""
+    keys = [(input_type, hashlib.blake2b(value.encode(), digest_size=16).digest()) for value in inputs]
+    embeddings = [embedding_cache.get(key) for key in keys]
+
+    # Only forward the cache misses, preparing them (e.g. decoding) first if needed
+    misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if misses:
+        miss_inputs = [inputs[i] for i in misses]
+        if prepare is not None:
+            miss_inputs = await prepare(miss_inputs)
+
+        # Misses are returned in fp32; each cached fp16 copy owns its storage instead of pinning the whole batch
+        for i, embedding in zip(misses, await batcher.embed(miss_inputs)):
+            embeddings[i] = embedding
+            embedding_cache[keys[i]] = embedding.half()
+
+    return torch.stack([embedding.float() for embedding in embeddings])
 
 @app.get("/")
 async def root():
@@ -201,22 +562,27 @@ async def list_models():
         ]
     }
 
-@app.post("/v1/embeddings")
-async def create_embeddings(request: EmbeddingRequest) -> EmbeddingResponse:
+@app.post("/v1/embeddings", response_model=EmbeddingResponse, response_class=ORJSONResponse)
+async def create_embeddings(request: EmbeddingRequest) -> ORJSONResponse:
     """Create embeddings for text and/or images"""
 
     if vision_model is None or text_model is None:
         raise HTTPException(status_code=503, detail="Models not loaded")
 
+    if request.encoding_format != "float" and request.encoding_format not in BASE64_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported encoding format: {request.encoding_format}"
+        )
+
     try:
-        embeddings_list = []
+        embeddings = None
         total_tokens = 0
 
         # Handle different input formats
         if isinstance(request.input, str):
             # Single text input
-            embeddings = process_text_input([request.input])
-            embeddings_list.extend(embeddings.cpu().numpy().tolist())
+            embeddings = await embed_cached(text_batcher, "text", [request.input])
             total_tokens += len(request.input.split())
 
         elif isinstance(request.input, list):
@@ -226,14 +592,13 @@ async def create_embeddings(request: EmbeddingRequest) -> EmbeddingResponse:
             # Check if list contains strings or EmbeddingInput objects
             if isinstance(request.input[0], str):
                 # List of strings
-                embeddings = process_text_input(request.input)
-                embeddings_list.extend(embeddings.cpu().numpy().tolist())
+                embeddings = await embed_cached(text_batcher, "text", request.input)
                 total_tokens += sum(len(text.split()) for text in request.input)
 
             else:
                 # List of EmbeddingInput objects (mixed text/image)
                 texts = []
-                images = []
+                image_urls = []
                 input_types = []
 
                 for item in request.input:
@@ -251,9 +616,8 @@ async def create_embeddings(request: EmbeddingRequest) -> EmbeddingResponse:
 
                         url = item.image_url["url"]
                         if url.startswith('data:'):
-                            # Base64 encoded image
-                            image = decode_base64_image(url)
-                            images.append(image)
+                            # Base64 encoded image, decoded below
+                            image_urls.append(url)
                             input_types.append("image")
                             total_tokens += 1  # Count images as 1 token
                         else:
@@ -267,39 +631,38 @@ async def create_embeddings(request: EmbeddingRequest) -> EmbeddingResponse:
                             detail=f"Unsupported input type: {item.type}"
                         )
 
-                # Process texts and images separately
-                all_embeddings = []
-
+                # Embed texts and images concurrently through the batchers; images are decoded on cache miss
+                pending = {}
                 if texts:
-                    text_embeddings = process_text_input(texts)
-                    all_embeddings.append(text_embeddings)
-
-                if images:
-                    image_embeddings = process_image_input(images)
-                    all_embeddings.append(image_embeddings)
+                    pending["text"] = embed_cached(text_batcher, "text", texts)
+                if image_urls:
+                    pending["image"] = embed_cached(image_batcher, "image", image_urls, prepare=decode_images)
+                results = dict(zip(pending, await asyncio.gather(*pending.values())))
 
                 # Combine embeddings in the original order
-                if all_embeddings:
-                    combined_embeddings = torch.cat(all_embeddings, dim=0)
-                    embeddings_list.extend(combined_embeddings.cpu().numpy().tolist())
+                rows = {input_type: iter(values) for input_type, values in results.items()}
+                embeddings = torch.stack([next(rows[input_type]) for input_type in input_types])
 
-        # Create response data
+        # Create response data as plain dicts; EmbeddingResponse only documents the schema
+        embeddings_list = encode_embeddings(embeddings, request.encoding_format)
         data = [
-            EmbeddingData(
-                embedding=embedding,
-                index=i
-            )
+            {
+                "object": "embedding",
+                "embedding": embedding,
+                "index": i
+            }
             for i, embedding in enumerate(embeddings_list)
         ]
 
-        return EmbeddingResponse(
-            data=data,
-            model=request.model,
-            usage=Usage(
-                prompt_tokens=total_tokens,
-                total_tokens=total_tokens
-            )
-        )
+        return ORJSONResponse({
+            "object": "list",
+            "data": data,
+            "model": request.model,
+            "usage": {
+                "prompt_tokens": total_tokens,
+                "total_tokens": total_tokens
+            }
+        })
 
     except HTTPException:
         raise
@@ -307,8 +670,8 @@ async def create_embeddings(request: EmbeddingRequest) -> EmbeddingResponse:
         logger.error(f"Error creating embeddings: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@app.post("/embeddings")
-async def create_embeddings_alt(request: EmbeddingRequest) -> EmbeddingResponse:
+@app.post("/embeddings", response_model=EmbeddingResponse, response_class=ORJSONResponse)
+async def create_embeddings_alt(request: EmbeddingRequest) -> ORJSONResponse:
     """Alternative endpoint without /v1 prefix"""
     return await create_embeddings(request)
 
@@ -322,10 +685,19 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if args.workers > 1:
+        # Split CPU threads between workers; inherited by the worker processes
+        threads = str(max(1, os.cpu_count() // args.workers))
+        os.environ.setdefault("OMP_NUM_THREADS", threads)
+        os.environ.setdefault("MKL_NUM_THREADS", threads)
+
     uvicorn.run(
-        app,  # Pass the app directly instead of module string
+        # uvicorn needs a module string to start multiple workers; otherwise pass the app directly
+        "embedding:app" if args.workers > 1 else app,
         host=args.host,
         port=args.port,
         workers=args.workers,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
\ No newline at end of file
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Export the Nomic Embed Text v1.5 encoder to OpenVINO IR for CPU-only serving
+nomic_bert is a remote-code architecture that optimum has no export configuration for,
+so it is exported with BERT's configuration (same inputs and last_hidden_state output)
+"""
+
+from transformers import AutoConfig
+from optimum.exporters.openvino import main_export
+from optimum.exporters.openvino.model_configs import BertOpenVINOConfig
+from optimum.intel import OVConfig
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the Nomic text encoder to OpenVINO")
+    parser.add_argument("output", help="Directory to write the OpenVINO model to")
+    parser.add_argument("--model", default="nomic-ai/nomic-embed-text-v1.5", help="Model to export")
+    parser.add_argument("--weight-format", default="fp16", choices=["fp16", "fp32"], help="Weight precision")
+
+    args = parser.parse_args()
+
+    config = AutoConfig.from_pretrained(args.model, trust_remote_code=True)
+
+    main_export(
+        args.model,
+        output=args.output,
+        task="feature-extraction",
+        trust_remote_code=True,
+        custom_export_configs={"model": BertOpenVINOConfig(config, task="feature-extraction")},
+        ov_config=OVConfig(dtype=args.weight_format)
+    )